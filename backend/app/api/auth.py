@@ -1,8 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from jose import JWTError, jwt
+from sqlalchemy import select, bindparam
+import jwt
+from loguru import logger
+from cachetools import TTLCache
+import aiofiles
+import aiofiles.os
+import asyncio
+import hashlib
+import os
+import time
 from app.core.database import get_db
 from app.models.schema import User as UserModel
 from datetime import timedelta
@@ -14,33 +22,91 @@ from app.services.auth import (
 router = APIRouter(prefix="/auth", tags=["auth"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
-    credentials_exception = HTTPException(
+# Uploaded avatars live next to the database so they survive container rebuilds
+AVATAR_DIR = "data/avatars"
+
+# Accepted avatar types (no SVG: it can carry scripts)
+_ALLOWED_IMAGE_TYPES = frozenset({"image/jpeg", "image/png", "image/webp", "image/gif"})
+
+# Image magic numbers -> (MIME type, file extension)
+_IMAGE_MAGIC = {
+    b"\xff\xd8\xff": ("image/jpeg", ".jpg"),
+    b"\x89PNG": ("image/png", ".png"),
+    b"GIF8": ("image/gif", ".gif"),
+}
+
+def _sniff_image(header: bytes):
+    """Detect image type from the leading bytes, returns (mime, ext) or None"""
+    header = bytes(header[:12])
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ("image/webp", ".webp")
+    return _IMAGE_MAGIC.get(header[:4]) or _IMAGE_MAGIC.get(header[:3])
+
+# Built once; users.username already carries a unique index
+_USER_BY_NAME = select(UserModel).where(UserModel.username == bindparam("u"))
+# Auth-only lookup: skips hydrating avatar_url (possibly a large data URI)
+_USER_REF_BY_NAME = select(UserModel.id, UserModel.username).where(UserModel.username == bindparam("u"))
+
+# Decoder instance reused across requests
+_JWT = jwt.PyJWT()
+_JWT_OPTIONS = {"require": ["sub", "exp"], "verify_aud": False}
+
+# Decoded tokens: raw token -> (username, exp epoch)
+_token_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+
+def _decode_token(token: str) -> str:
+    """Return the username of a valid token, consulting the decode cache first"""
+    cached = _token_cache.get(token)
+    if cached and cached[1] > time.time():
+        return cached[0]
+    payload = _JWT.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options=_JWT_OPTIONS)
+    username = payload["sub"]
+    _token_cache[token] = (username, payload["exp"])
+    return username
+
+def forget_cached_tokens(username: str):
+    """Drop a user's tokens from the decode cache (the tokens themselves stay valid until they expire)"""
+    for token in [t for t, (name, _) in _token_cache.items() if name == username]:
+        _token_cache.pop(token, None)
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _token_username(token: str) -> str:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-        
-    result = await db.execute(select(UserModel).where(UserModel.username == token_data.username))
+        token_data = TokenData(username=_decode_token(token))
+    except jwt.PyJWTError:
+        raise _credentials_exception()
+    return token_data.username
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    """Authenticate the request, returning a lightweight (id, username) row"""
+    result = await db.execute(_USER_REF_BY_NAME, {"u": _token_username(token)})
+    user = result.one_or_none()
+    if user is None:
+        raise _credentials_exception()
+    return user
+
+async def get_current_user_full(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    """Authenticate the request, returning the full User model"""
+    result = await db.execute(_USER_BY_NAME, {"u": _token_username(token)})
     user = result.scalar_one_or_none()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
 
 @router.post("/login", response_model=Token)
 async def login(db: AsyncSession = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
-    result = await db.execute(select(UserModel).where(UserModel.username == form_data.username))
+    result = await db.execute(_USER_BY_NAME, {"u": form_data.username})
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    # Hashing is CPU bound, keep it off the event loop
+    loop = asyncio.get_running_loop()
+    if not user or not await loop.run_in_executor(None, verify_password, form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -54,7 +120,7 @@ async def login(db: AsyncSession = Depends(get_db), form_data: OAuth2PasswordReq
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/profile")
-async def get_profile(current_user: UserModel = Depends(get_current_user)):
+async def get_profile(current_user: UserModel = Depends(get_current_user_full)):
     return {
         "username": current_user.username,
         "avatar_url": current_user.avatar_url,
@@ -64,46 +130,72 @@ async def get_profile(current_user: UserModel = Depends(get_current_user)):
 @router.put("/profile")
 async def update_profile(
     data: dict, 
-    current_user: UserModel = Depends(get_current_user),
+    current_user: UserModel = Depends(get_current_user_full),
     db: AsyncSession = Depends(get_db)
 ):
     if "avatar_url" in data:
         current_user.avatar_url = data["avatar_url"]
     
     if "password" in data:
-        current_user.hashed_password = get_password_hash(data["password"])
+        loop = asyncio.get_running_loop()
+        current_user.hashed_password = await loop.run_in_executor(None, get_password_hash, data["password"])
+        forget_cached_tokens(current_user.username)
         
     await db.commit()
     return {"status": "success"}
 
+async def _remove_unused_avatar(db: AsyncSession, avatar_url: str):
+    """Delete a replaced avatar file unless another user still points at it (names are content hashes)"""
+    in_use = await db.execute(select(UserModel.id).where(UserModel.avatar_url == avatar_url).limit(1))
+    if in_use.first():
+        return
+    try:
+        await aiofiles.os.remove(os.path.join(AVATAR_DIR, os.path.basename(avatar_url)))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove old avatar {avatar_url}: {e}")
+
 @router.post("/upload_avatar")
 async def upload_avatar(
     file: UploadFile = File(...),
-    current_user: UserModel = Depends(get_current_user),
+    current_user: UserModel = Depends(get_current_user_full),
     db: AsyncSession = Depends(get_db)
 ):
-    import base64
-    
-    # Validate file type
-    if not file.content_type.startswith("image/"):
+    # Validate file type: declared type must be allowed and the magic bytes must be an image
+    if file.content_type not in _ALLOWED_IMAGE_TYPES:
+        raise HTTPException(status_code=400, detail="File must be an image")
+    file_content = bytearray(await file.read(512))
+    image_type = _sniff_image(file_content)
+    if not image_type:
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Validate file size (max 2MB)
+    # Validate file size (max 2MB) while streaming, aborting on the first over-limit chunk
     max_size = 2 * 1024 * 1024
-    file_content = await file.read()
-    if len(file_content) > max_size:
-        raise HTTPException(status_code=400, detail="Avatar file too large (max 2MB)")
+    chunk_size = 64 * 1024
+    while chunk := await file.read(chunk_size):
+        file_content += chunk
+        if len(file_content) > max_size:
+            raise HTTPException(status_code=413, detail="Avatar file too large (max 2MB)")
     
-    # Convert to base64 data URI
+    # Store under a content-hashed name so the URL is cacheable
+    digest = hashlib.blake2b(file_content, digest_size=16).hexdigest()
+    filename = f"{digest}{image_type[1]}"
     try:
-        base64_str = base64.b64encode(file_content).decode('utf-8')
-        avatar_data_uri = f"data:{file.content_type};base64,{base64_str}"
+        os.makedirs(AVATAR_DIR, exist_ok=True)
+        async with aiofiles.open(os.path.join(AVATAR_DIR, filename), "wb") as f:
+            await f.write(file_content)
     except Exception as e:
-        logger.error(f"Failed to encode avatar: {e}")
+        logger.error(f"Failed to save avatar: {e}")
         raise HTTPException(status_code=500, detail="Could not process image")
     
-    # Update user avatar (store base64 data URI)
-    current_user.avatar_url = avatar_data_uri
+    # Update user avatar (store served path)
+    avatar_url = f"/avatars/{filename}"
+    old_avatar_url = current_user.avatar_url
+    current_user.avatar_url = avatar_url
     await db.commit()
     
-    return {"status": "success", "avatar_url": avatar_data_uri}
+    if old_avatar_url and old_avatar_url != avatar_url and old_avatar_url.startswith("/avatars/"):
+        await _remove_unused_avatar(db, old_avatar_url)
+    
+    return {"status": "success", "avatar_url": avatar_url}
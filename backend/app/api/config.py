@@ -1,18 +1,30 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field, field_validator
 from app.core.config import settings
 from app.services.p115 import p115_service
 from app.services.tg_bot import tg_service
+from app.services.scheduler import cleanup_scheduler
+from app.services.tmdb import TMDBClient
 from app.api.auth import get_current_user
 from app.version import VERSION
 from loguru import logger
 import asyncio
+import functools
+from contextlib import asynccontextmanager
+import ssl
+import aiohttp
 from apscheduler.triggers.cron import CronTrigger
 
 router = APIRouter(prefix="/config", tags=["config"])
 
 from typing import Optional
 
+@functools.lru_cache(maxsize=64)
+def _parse_cron(expr: str) -> bool:
+    """Validate a crontab expression; raises on invalid input, successes are cached"""
+    CronTrigger.from_crontab(expr)
+    return True
+
 class ConfigUpdate(BaseModel):
     tg_bot_token: Optional[str] = None
     tg_channel_id: Optional[str] = None
@@ -43,7 +55,7 @@ class ConfigUpdate(BaseModel):
         if v is None or v == "":
             return v
         try:
-            CronTrigger.from_crontab(v)
+            _parse_cron(v)
             return v
         except Exception:
             raise ValueError('无效的 Cron 表达式')
@@ -55,141 +67,148 @@ class ConfigUpdate(BaseModel):
             raise ValueError('容量限制最小值为 1 TB')
         return v
 
+# ConfigUpdate field -> Settings attribute
+FIELD_MAP = {field: field.upper() for field in ConfigUpdate.model_fields}
+PROXY_FIELDS = frozenset({"proxy_enabled", "proxy_host", "proxy_port", "proxy_user", "proxy_pass", "proxy_type"})
+CAPACITY_FIELDS = frozenset({"p115_cleanup_capacity_enabled", "p115_cleanup_capacity_limit", "p115_cleanup_capacity_unit"})
+
+# ConfigUpdate field -> side effects to run once after a change is saved
+FIELD_EFFECTS = {
+    "tg_bot_token": ("restart_bot",),
+    "p115_cookie": ("reinit_p115",),
+    "p115_cleanup_dir_cron": ("update_dir_job",),
+    "p115_cleanup_trash_cron": ("update_trash_job",),
+    **{field: ("reinit_proxy",) for field in PROXY_FIELDS},
+    **{field: ("update_capacity_job",) for field in CAPACITY_FIELDS},
+}
+
 @router.post("/update")
 async def update_config(cfg: ConfigUpdate, user=Depends(get_current_user)):
-    # Use model_dump(exclude_unset=True) to get only fields sent by frontend
-    update_data = cfg.model_dump(exclude_unset=True)
+    # Only fields sent by frontend; values are already validated, read them
+    # straight from the instance instead of a model_dump serializer pass.
+    # An explicit null means "no value sent": settings are never stored as None.
+    # Walk FIELD_MAP (model field order) so updated_fields and the log line are stable
+    values, sent = cfg.__dict__, cfg.model_fields_set
+    update_data = {field: values[field] for field in FIELD_MAP if field in sent and values[field] is not None}
     if not update_data:
         return {"status": "success", "message": "无变更"}
     
     logger.info(f"⚙️ 收到配置更新请求，包含字段: {list(update_data.keys())}")
-    need_restart_bot = False
-    proxy_changed = False
     
-    # 1. Update TG settings
-    if "tg_bot_token" in update_data and settings.TG_BOT_TOKEN != cfg.tg_bot_token:
-        await settings.save_setting("TG_BOT_TOKEN", cfg.tg_bot_token)
-        need_restart_bot = True
-        
-    if "tg_channel_id" in update_data:
-        await settings.save_setting("TG_CHANNEL_ID", cfg.tg_channel_id)
-    if "tg_user_id" in update_data:
-        await settings.save_setting("TG_USER_ID", cfg.tg_user_id)
-    if "tg_allow_chats" in update_data:
-        await settings.save_setting("TG_ALLOW_CHATS", cfg.tg_allow_chats)
-    if "tg_channels" in update_data:
-        await settings.save_setting("TG_CHANNELS", cfg.tg_channels)
+    # Capacity cleanup: minimum 1 TB, unit is always TB
+    if "p115_cleanup_capacity_limit" in update_data:
+        update_data["p115_cleanup_capacity_limit"] = max(1.0, float(update_data["p115_cleanup_capacity_limit"]))
+    if "p115_cleanup_capacity_unit" in update_data:
+        update_data["p115_cleanup_capacity_unit"] = "TB"
     
-    # 2. Update 115 settings
-    if "p115_cookie" in update_data and settings.P115_COOKIE != cfg.p115_cookie:
-        await settings.save_setting("P115_COOKIE", cfg.p115_cookie)
-        p115_service.init_client(cfg.p115_cookie)
-        
-    if "p115_save_dir" in update_data:
-        await settings.save_setting("P115_SAVE_DIR", cfg.p115_save_dir)
-    if "p115_recycle_password" in update_data:
-        await settings.save_setting("P115_RECYCLE_PASSWORD", cfg.p115_recycle_password)
-    if "p115_organize_base_dir" in update_data:  # 新增
-        await settings.save_setting("P115_ORGANIZE_BASE_DIR", cfg.p115_organize_base_dir)
+    # Snapshot the current values once, diff against them and persist all changes in one transaction
+    snapshot = {field: getattr(settings, FIELD_MAP[field]) for field in update_data}
+    changed = {field: val for field, val in update_data.items() if snapshot[field] != val}
+    if changed:
+        await settings.save_settings_bulk({FIELD_MAP[field]: val for field, val in changed.items()})
+    p115_cookie = settings.P115_COOKIE
+    tg_bot_token = settings.TG_BOT_TOKEN
     
-    # 3. Update Proxy settings
-    proxy_fields = ["proxy_enabled", "proxy_host", "proxy_port", "proxy_user", "proxy_pass", "proxy_type"]
-    for field in proxy_fields:
-        if field in update_data:
-            current_val = getattr(settings, field.upper())
-            new_val = getattr(cfg, field)
-            if current_val != new_val:
-                await settings.save_setting(field.upper(), new_val)
-                proxy_changed = True
+    # Collect side effects as a set so each runs at most once
+    effects = {effect for field in changed for effect in FIELD_EFFECTS.get(field, ())}
     
-    # Reinitialize services if proxy changed
-    if proxy_changed:
+    # Proxy changes reinitialize whichever clients are configured
+    if "reinit_proxy" in effects:
         logger.info("🌐 代理设置内容已发生实质变化，重新初始化相关服务...")
-        if settings.P115_COOKIE:
-            p115_service.init_client(settings.P115_COOKIE)
-        if settings.TG_BOT_TOKEN:
-            need_restart_bot = True
+        if p115_cookie:
+            effects.add("reinit_p115")
+        if tg_bot_token:
+            effects.add("restart_bot")
+    
+    if "reinit_p115" in effects:
+        p115_service.init_client(p115_cookie)
     
-    # 4. Update Cron tasks
-    if "p115_cleanup_dir_cron" in update_data and settings.P115_CLEANUP_DIR_CRON != cfg.p115_cleanup_dir_cron:
-        await settings.save_setting("P115_CLEANUP_DIR_CRON", cfg.p115_cleanup_dir_cron)
-        from app.services.scheduler import cleanup_scheduler
+    # Cron and capacity cleanup jobs
+    if "update_dir_job" in effects:
         cleanup_scheduler.update_cleanup_dir_job()
-        
-    if "p115_cleanup_trash_cron" in update_data and settings.P115_CLEANUP_TRASH_CRON != cfg.p115_cleanup_trash_cron:
-        await settings.save_setting("P115_CLEANUP_TRASH_CRON", cfg.p115_cleanup_trash_cron)
-        from app.services.scheduler import cleanup_scheduler
+    if "update_trash_job" in effects:
         cleanup_scheduler.update_cleanup_trash_job()
-
-    # 4.5 Update Capacity Cleanup (Consolidated)
-    capacity_fields = ["p115_cleanup_capacity_enabled", "p115_cleanup_capacity_limit", "p115_cleanup_capacity_unit"]
-    capacity_changed = False
-    for field in capacity_fields:
-        if field in update_data:
-            val = update_data[field]
-            if field == "p115_cleanup_capacity_limit":
-                val = max(1.0, float(val))
-            elif field == "p115_cleanup_capacity_unit":
-                val = "TB"
-                
-            current_val = getattr(settings, field.upper())
-            if current_val != val:
-                await settings.save_setting(field.upper(), val)
-                capacity_changed = True
-    
-    if capacity_changed:
-        from app.services.scheduler import cleanup_scheduler
+    if "update_capacity_job" in effects:
         cleanup_scheduler.update_cleanup_capacity_job()
     
-    # 5. TMDB settings
-    if "tmdb_api_key" in update_data:
-        await settings.save_setting("TMDB_API_KEY", cfg.tmdb_api_key)
-    if "tmdb_config" in update_data:
-        await settings.save_setting("TMDB_CONFIG", cfg.tmdb_config)
-    
-    # 6. Unified restart bot polling
+    # Unified restart bot polling
+    need_restart_bot = "restart_bot" in effects
     if need_restart_bot:
-        asyncio.create_task(tg_service.restart_polling())
+        tg_service.schedule_restart()
         logger.info("🔄 正在触发机器人安全重启任务...")
     
     return {"status": "success", "bot_restarted": need_restart_bot, "updated_fields": list(update_data.keys())}
 
-@router.get("/")
+class ConfigResponse(BaseModel):
+    tg_bot_token: str
+    tg_bot_connected: bool
+    tg_channel_id: str
+    tg_user_id: str
+    tg_allow_chats: str
+    tg_channels: str
+    p115_cookie: str
+    p115_logged_in: bool
+    p115_save_dir: str
+    p115_cleanup_dir_cron: str
+    p115_cleanup_trash_cron: str
+    p115_recycle_password: str
+    proxy_enabled: bool
+    proxy_host: str
+    proxy_port: str
+    proxy_user: str
+    proxy_pass: str
+    proxy_type: str
+    p115_cleanup_capacity_enabled: bool
+    p115_cleanup_capacity_limit: float
+    p115_cleanup_capacity_unit: str
+    tmdb_api_key: str
+    tmdb_config: str
+    p115_organize_base_dir: str  # 新增
+    version: str
+
+@router.get("/", response_model=ConfigResponse)
 async def get_config(user=Depends(get_current_user)):
-    return {
-        "tg_bot_token": settings.TG_BOT_TOKEN,
-        "tg_bot_connected": tg_service.is_connected,
-        "tg_channel_id": settings.TG_CHANNEL_ID,
-        "tg_user_id": settings.TG_USER_ID,
-        "tg_allow_chats": settings.TG_ALLOW_CHATS,
-        "tg_channels": settings.TG_CHANNELS,
-        "p115_cookie": settings.P115_COOKIE,
-        "p115_logged_in": p115_service.is_connected,
-        "p115_save_dir": settings.P115_SAVE_DIR,
-        "p115_cleanup_dir_cron": settings.P115_CLEANUP_DIR_CRON,
-        "p115_cleanup_trash_cron": settings.P115_CLEANUP_TRASH_CRON,
-        "p115_recycle_password": settings.P115_RECYCLE_PASSWORD,
-        "proxy_enabled": settings.PROXY_ENABLED,
-        "proxy_host": settings.PROXY_HOST,
-        "proxy_port": settings.PROXY_PORT,
-        "proxy_user": settings.PROXY_USER,
-        "proxy_pass": settings.PROXY_PASS,
-        "proxy_type": settings.PROXY_TYPE,
-        "p115_cleanup_capacity_enabled": settings.P115_CLEANUP_CAPACITY_ENABLED,
-        "p115_cleanup_capacity_limit": settings.P115_CLEANUP_CAPACITY_LIMIT,
-        "p115_cleanup_capacity_unit": settings.P115_CLEANUP_CAPACITY_UNIT,
-        "tmdb_api_key": settings.TMDB_API_KEY,
-        "tmdb_config": settings.TMDB_CONFIG,
-        "p115_organize_base_dir": settings.P115_ORGANIZE_BASE_DIR,  # 新增
-        "version": VERSION
-    }
+    # Values come typed from the in-memory settings cache; response_model validates and filters them
+    data = {field: settings.get(key) for field, key in FIELD_MAP.items()}
+    data["tg_bot_connected"] = tg_service.is_connected
+    data["p115_logged_in"] = p115_service.is_connected
+    data["version"] = VERSION
+    return data
+
+# Shared plain client for proxy tests; HTTP proxies are passed per request, so its
+# connection pool, DNS cache and SSL context survive between tests
+_ssl_context = ssl.create_default_context()
+_plain_session: Optional[aiohttp.ClientSession] = None
+
+def _get_proxy_test_session() -> aiohttp.ClientSession:
+    global _plain_session
+    if _plain_session is None or _plain_session.closed:
+        connector = aiohttp.TCPConnector(limit=8, ttl_dns_cache=300, ssl=_ssl_context)
+        _plain_session = aiohttp.ClientSession(connector=connector)
+    return _plain_session
+
+@asynccontextmanager
+async def _proxy_test_client(proxy_url: str, socks: bool):
+    """(session, proxy argument) for one probe; a SOCKS proxy needs its own connector, closed afterwards"""
+    if not socks:
+        yield _get_proxy_test_session(), proxy_url
+        return
+    from aiohttp_socks import ProxyConnector
+
+    connector = ProxyConnector.from_url(proxy_url, ssl=_ssl_context)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        yield session, None
+
+async def close_proxy_test_session():
+    """Close the shared proxy test client (called on shutdown)"""
+    global _plain_session
+    if _plain_session is not None and not _plain_session.closed:
+        await _plain_session.close()
+    _plain_session = None
 
 @router.post("/test-proxy")
 async def test_proxy(cfg: ConfigUpdate, user=Depends(get_current_user)):
     """Test proxy connectivity"""
-    import aiohttp
-    from aiohttp_socks import ProxyConnector
-    
     if not cfg.proxy_enabled:
         return {"status": "error", "message": "代理未启用"}
     
@@ -204,19 +223,15 @@ async def test_proxy(cfg: ConfigUpdate, user=Depends(get_current_user)):
     
     try:
         timeout = aiohttp.ClientTimeout(total=10)
-        connector = None
-        if proxy_type == 'socks5':
-            connector = ProxyConnector.from_url(proxy_url)
-        
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-            # Test with a reliable endpoint
-            test_url = "https://api.telegram.org"
-            proxy_arg = proxy_url if proxy_type != 'socks5' else None
-            async with session.get(test_url, proxy=proxy_arg) as response:
-                if response.status == 200:
-                    return {"status": "success", "message": "代理连接成功"}
-                else:
-                    return {"status": "error", "message": f"代理返回错误状态码: {response.status}"}
+        # Test with a reliable endpoint
+        test_url = "https://api.telegram.org"
+        async with _proxy_test_client(proxy_url, socks=proxy_type == 'socks5') as (session, proxy_arg):
+            async with session.get(test_url, proxy=proxy_arg, timeout=timeout) as response:
+                status = response.status
+        if status == 200:
+            return {"status": "success", "message": "代理连接成功"}
+        else:
+            return {"status": "error", "message": f"代理返回错误状态码: {status}"}
     except Exception as e:
         logger.error(f"❌ 代理测试失败: {e}")
         err_msg = str(e)
@@ -227,28 +242,39 @@ async def test_proxy(cfg: ConfigUpdate, user=Depends(get_current_user)):
 @router.post("/detect-proxy-protocol")
 async def detect_proxy_protocol(cfg: ConfigUpdate, user=Depends(get_current_user)):
     """Auto-detect proxy protocol (HTTP or SOCKS5)"""
-    import aiohttp
-    from aiohttp_socks import ProxyConnector
-    
     if not cfg.proxy_host or not cfg.proxy_port:
         return {"status": "error", "message": "代理地址或端口不能为空"}
         
     protocols = ["HTTP", "SOCKS5"]
     auth = f"{cfg.proxy_user}:{cfg.proxy_pass}@" if cfg.proxy_user and cfg.proxy_pass else ""
     
-    for proto in protocols:
+    async def probe(proto: str) -> bool:
         proxy_url = f"{proto.lower()}://{auth}{cfg.proxy_host}:{cfg.proxy_port}"
         logger.info(f"🔍 尝试检测协议: {proxy_url}")
         try:
             timeout = aiohttp.ClientTimeout(total=5)
-            connector = ProxyConnector.from_url(proxy_url) if proto == "SOCKS5" else None
-            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-                proxy_arg = proxy_url if proto == "HTTP" else None
-                async with session.get("https://www.google.com", proxy=proxy_arg) as resp:
-                    if resp.status == 200:
-                        return {"status": "success", "protocol": proto, "message": f"检测到协议: {proto}"}
+            test_url = "https://www.google.com/generate_204"
+            async with _proxy_test_client(proxy_url, socks=proto == "SOCKS5") as (session, proxy_arg):
+                async with session.head(test_url, proxy=proxy_arg, timeout=timeout) as resp:
+                    return resp.status < 400
         except Exception:
-            continue
+            return False
+    
+    # Probe all protocols concurrently. On a mixed port the earlier protocol in the list wins, so
+    # answer once it succeeded or every protocol before a success failed, and cancel the rest
+    probes = [asyncio.create_task(probe(proto)) for proto in protocols]
+    try:
+        pending = set(probes)
+        while pending:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for proto, task in zip(protocols, probes):
+                if not task.done():
+                    break
+                if task.result():
+                    return {"status": "success", "protocol": proto, "message": f"检测到协议: {proto}"}
+    finally:
+        for task in probes:
+            task.cancel()
             
     return {"status": "error", "message": "未能检测到有效协议，请手动指定"}
 
@@ -261,12 +287,7 @@ async def test_bot(user=Depends(get_current_user)):
 @router.post("/test-channel")
 async def test_channel(user=Depends(get_current_user)):
     logger.info("🛠 用户触发了频道广播测试")
-    import json
-    channels = []
-    try:
-        channels = json.loads(settings.TG_CHANNELS)
-    except Exception:
-        pass
+    channels = settings.tg_channels_parsed
     
     # Also include the legacy channel ID if it exists and not in the list
     legacy_id = settings.TG_CHANNEL_ID
@@ -278,9 +299,14 @@ async def test_channel(user=Depends(get_current_user)):
     if not enabled_channels:
         return {"status": "error", "message": "未配置或未启用任何频道"}
     
+    # Send to all channels concurrently
+    outcomes = await asyncio.gather(
+        *(tg_service.test_send_to_channel(chan.get("id")) for chan in enabled_channels),
+        return_exceptions=True
+    )
     results = []
-    for chan in enabled_channels:
-        success, msg = await tg_service.test_send_to_channel(chan.get("id"))
+    for chan, outcome in zip(enabled_channels, outcomes):
+        success, msg = (False, str(outcome)) if isinstance(outcome, Exception) else outcome
         results.append({"id": chan.get("id"), "success": success, "message": msg})
     
     all_success = all(r["success"] for r in results)
@@ -321,17 +347,14 @@ async def cleanup_recycle_bin(user=Depends(get_current_user)):
 @router.post("/clear-history")
 async def clear_history(user=Depends(get_current_user)):
     """Clear all link share history"""
-    from app.services.p115 import p115_service
     result = await p115_service.delete_all_history_links()
     if result:
         return {"status": "success", "message": "已清空所有历史记录"}
     else:
-        from fastapi import HTTPException
         raise HTTPException(status_code=500, detail="清空历史记录失败")
 
 @router.post("/test-tmdb")
 async def test_tmdb(cfg: ConfigUpdate, user=Depends(get_current_user)):
-    from app.services.tmdb import TMDBClient
     if not cfg.tmdb_api_key:
         return {"status": "error", "message": "API Key 不能为空"}
     client = TMDBClient(cfg.tmdb_api_key)
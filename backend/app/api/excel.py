@@ -2,7 +2,7 @@ import json
 from typing import List, Optional
 from pydantic import BaseModel
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, func
 from app.core.database import async_session
 from app.models.schema import ExcelTask, ExcelTaskItem
 from app.services.excel_batch import excel_batch_service
@@ -10,6 +10,11 @@ from app.api.auth import get_current_user
 
 router = APIRouter(prefix="/excel", tags=["excel"])
 
+# List endpoints return plain column rows instead of tracked ORM objects;
+# item pages leave out item_metadata (the original message text and entities)
+_TASK_COLUMNS = tuple(ExcelTask.__table__.c)
+_ITEM_LIST_COLUMNS = tuple(c for c in ExcelTaskItem.__table__.c if c.key != "item_metadata")
+
 class StartTaskRequest(BaseModel):
     skip_count: Optional[int] = 0
     interval_min: Optional[int] = 5
@@ -23,9 +28,9 @@ async def parse_excel(
     file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user)
 ):
-    content = await file.read()
+    # UploadFile is already spooled to disk for large uploads, pass the stream through
     try:
-        result = await excel_batch_service.parse_file(content, file.filename)
+        result = await excel_batch_service.parse_file(file.file, file.filename)
         return {"status": "success", "data": result}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -37,10 +42,9 @@ async def create_task(
     file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user)
 ):
-    content = await file.read()
     try:
         mapping_dict = json.loads(mapping)
-        task_id = await excel_batch_service.create_task(filename, mapping_dict, content)
+        task_id = await excel_batch_service.create_task(filename, mapping_dict, file.file)
         return {"status": "success", "task_id": task_id}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -48,8 +52,8 @@ async def create_task(
 @router.get("/tasks")
 async def list_tasks(current_user: dict = Depends(get_current_user)):
     async with async_session() as session:
-        result = await session.execute(select(ExcelTask).order_by(desc(ExcelTask.created_at)))
-        tasks = result.scalars().all()
+        result = await session.execute(select(*_TASK_COLUMNS).order_by(desc(ExcelTask.created_at)))
+        tasks = [dict(row) for row in result.mappings()]
         return {"status": "success", "data": tasks}
 
 @router.get("/tasks/{task_id}")
@@ -70,21 +74,25 @@ async def get_task_items(
     current_user: dict = Depends(get_current_user)
 ):
     async with async_session() as session:
-        query = select(ExcelTaskItem).where(ExcelTaskItem.task_id == task_id)
+        # Page rows and the filtered total in one round trip (window count)
+        query = select(*_ITEM_LIST_COLUMNS, func.count().over().label("total")).where(ExcelTaskItem.task_id == task_id)
         if status:
             query = query.where(ExcelTaskItem.status == status)
         
-        query = query.order_by(ExcelTaskItem.row_index)
-        
-        # Count total
-        from sqlalchemy import func
-        count_query = select(func.count()).select_from(query.subquery())
-        total = await session.scalar(count_query)
+        query = query.order_by(ExcelTaskItem.row_index).offset((page - 1) * page_size).limit(page_size)
+        rows = (await session.execute(query)).mappings().all()
+        items = [{col.key: row[col.key] for col in _ITEM_LIST_COLUMNS} for row in rows]
         
-        # Pagination
-        query = query.offset((page - 1) * page_size).limit(page_size)
-        result = await session.execute(query)
-        items = result.scalars().all()
+        if rows:
+            total = rows[0]["total"]
+        elif page > 1:
+            # Past the last page: no row carries the total, count separately
+            count_query = select(func.count(ExcelTaskItem.id)).where(ExcelTaskItem.task_id == task_id)
+            if status:
+                count_query = count_query.where(ExcelTaskItem.status == status)
+            total = await session.scalar(count_query)
+        else:
+            total = 0
         
         return {
             "status": "success", 
@@ -1,12 +1,35 @@
-import os
-import json
+import asyncio
+import hashlib
+import orjson
+from pydantic import PrivateAttr
 from pydantic_settings import BaseSettings
 from typing import Optional
 from loguru import logger
-from sqlalchemy import select, update
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import engine, async_session, Base
 from app.models.schema import User as UserModel, SystemSettings
 
+# Indexes dropped from the models that existing databases may still carry
+RETIRED_INDEXES = frozenset({"ix_excel_task_items_task_id"})
+
+# Seconds to wait before flushing deferred settings writes
+FLUSH_DELAY = 0.2
+
+def _schema_hash() -> int:
+    """Fingerprint of the declared tables, columns and indexes (fits SQLite's 32-bit user_version)"""
+    schema = [
+        (
+            table.name,
+            [(col.name, str(col.type)) for col in table.columns],
+            sorted(index.name for index in table.indexes),
+        )
+        for table in Base.metadata.sorted_tables
+    ]
+    digest = hashlib.blake2b(repr(schema).encode(), digest_size=4).digest()
+    return int.from_bytes(digest, "big") & 0x7FFFFFFF
+
 class Settings(BaseSettings):
     # Telegram
     TG_BOT_TOKEN: str = ""
@@ -50,9 +73,44 @@ class Settings(BaseSettings):
     # 新增：整理根目录，为空则使用 P115_SAVE_DIR
     P115_ORGANIZE_BASE_DIR: str = ""
 
+    # In-memory view of all setting values, kept in sync on load/save
+    _cache: dict = PrivateAttr(default_factory=dict)
+    # Deferred DB writes: saves update memory first and mark keys dirty,
+    # a background flush coalesces everything saved within FLUSH_DELAY
+    _deferred_writes: bool = PrivateAttr(default=False)
+    _dirty_keys: set = PrivateAttr(default_factory=set)
+    _flush_task: Optional[asyncio.Task] = PrivateAttr(default=None)
+    # Parsed TG_CHANNELS, rebuilt lazily after the raw value changes
+    _tg_channels_parsed: Optional[list] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context):
+        super().model_post_init(__context)
+        self._cache.update({field: getattr(self, field) for field in type(self).model_fields})
+
+    def get(self, key: str, default=None):
+        """Read a setting from the in-memory cache"""
+        return self._cache.get(key, default)
+
+    @property
+    def tg_channels_parsed(self) -> list:
+        """TG_CHANNELS as a list of {id, enabled, concise} dicts (a fresh list per call)"""
+        if self._tg_channels_parsed is None:
+            try:
+                channels = orjson.loads(self.TG_CHANNELS)
+            except (orjson.JSONDecodeError, TypeError):
+                channels = []
+            self._tg_channels_parsed = channels if isinstance(channels, list) else []
+        return list(self._tg_channels_parsed)
+
     def _migrate_columns(self, conn):
         """Check all model tables for missing columns and add them via ALTER TABLE"""
         from sqlalchemy import inspect, text
+        
+        # The schema fingerprint is kept in PRAGMA user_version; skip introspection when unchanged
+        schema_hash = _schema_hash()
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() == schema_hash:
+            return
+        
         inspector = inspect(conn)
         
         for table in Base.metadata.sorted_tables:
@@ -87,91 +145,164 @@ class Settings(BaseSettings):
                     conn.execute(text(sql))
                     logger.info(f"[DB] 数据库迁移: 为表 {table_name} 添加列 {column.name}")
 
+            # create_all skips existing tables, so add indexes declared later
+            existing_indexes = {idx['name'] for idx in inspector.get_indexes(table_name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    logger.info(f"[DB] 数据库迁移: 为表 {table_name} 添加索引 {index.name}")
+            for index_name in existing_indexes & RETIRED_INDEXES:
+                conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index_name}")
+                logger.info(f"[DB] 数据库迁移: 删除表 {table_name} 的冗余索引 {index_name}")
+
+        conn.exec_driver_sql(f"PRAGMA user_version = {schema_hash}")
+
     async def init_db(self):
         """Initialize database tables and ensure schema is up-to-date"""
+        # DDL, admin seed and settings seed share one transaction (one commit at startup)
         async with engine.begin() as conn:
             # Create tables (handles fresh database)
             await conn.run_sync(Base.metadata.create_all)
             # Migrate missing columns for existing databases
             await conn.run_sync(self._migrate_columns)
 
-        async with async_session() as session:
-            # Check if admin exists
-            result = await session.execute(
-                select(UserModel).where(UserModel.username == "admin")
-            )
-            if not result.scalar_one_or_none():
-                from app.services.auth import get_password_hash
-
-                admin = UserModel(
-                    username="admin",
-                    hashed_password=get_password_hash("admin"),
-                    avatar_url="/logo.png",
+            # Session joins the connection's transaction; flush, the outer block commits
+            async with AsyncSession(bind=conn, expire_on_commit=False) as session:
+                # Check if admin exists (id only, no need to load the row)
+                admin_id = await session.scalar(
+                    select(UserModel.id).where(UserModel.username == "admin").limit(1)
                 )
-                session.add(admin)
-                logger.info("Default admin user created (admin/admin)")
+                if admin_id is None:
+                    from app.services.auth import get_password_hash
 
-            # Check if we need to migrate or add missing settings
-            await self._ensure_all_settings_exist(session)
-            await self._load_from_db(session)
+                    admin = UserModel(
+                        username="admin",
+                        hashed_password=get_password_hash("admin"),
+                        avatar_url="/logo.png",
+                    )
+                    session.add(admin)
+                    logger.info("Default admin user created (admin/admin)")
 
-            await session.commit()
+                # Check if we need to migrate or add missing settings
+                await self._ensure_all_settings_exist(session)
+                await self._load_from_db(session)
+
+                await session.flush()
 
     async def _ensure_all_settings_exist(self, session):
         """Ensure all fields defined in Settings exist in the system_settings table"""
-        result = await session.execute(select(SystemSettings.key))
-        existing_keys = set(result.scalars().all())
-        
-        added_count = 0
-        for field in self.model_fields:
-            if field not in existing_keys:
-                val = getattr(self, field)
-                session.add(SystemSettings(key=field, value=str(val)))
-                added_count += 1
-        
-        if added_count > 0:
-            logger.info(f"💾 Added {added_count} missing settings to database.")
+        # Insert defaults for every field; existing keys are left untouched by DO NOTHING
+        rows = [{"key": field, "value": str(getattr(self, field))} for field in _CASTERS]
+        stmt = sqlite_insert(SystemSettings).on_conflict_do_nothing(index_elements=[SystemSettings.key])
+        # Core executemany on the session's connection: the ORM result of a bulk insert has no rowcount
+        conn = await session.connection()
+        result = await conn.execute(stmt, rows)
+        if result.rowcount and result.rowcount > 0:
+            logger.info(f"💾 Added {result.rowcount} missing settings to database.")
 
     async def _load_from_db(self, session):
         """Load settings from system_settings table"""
-        result = await session.execute(select(SystemSettings))
-        rows = result.scalars().all()
-        for row in rows:
-            if hasattr(self, row.key):
-                # Type casting
-                field_type = self.model_fields[row.key].annotation
-                try:
-                    if field_type == int:
-                        setattr(self, row.key, int(row.value))
-                    elif field_type == float:
-                        setattr(self, row.key, float(row.value))
-                    elif field_type == bool:
-                        setattr(self, row.key, row.value.lower() == "true")
-                    else:
-                        setattr(self, row.key, row.value)
-                except Exception as e:
-                    logger.error(f"Failed to cast setting {row.key}: {e}")
+        result = await session.execute(select(SystemSettings.key, SystemSettings.value))
+        casted = {}
+        for key, value in result:
+            if key not in _CASTERS:
+                continue
+            caster = _CASTERS[key]
+            try:
+                casted[key] = caster(value) if caster is not None else value
+            except Exception as e:
+                logger.error(f"Failed to cast setting {key}: {e}")
+        if not casted:
+            return
+        # Values come from our own writes, assign them in one go without per-field setattr
+        self.__dict__.update(casted)
+        self._cache.update(casted)
+        self._tg_channels_parsed = None
 
     async def save_setting(self, key: str, value: str):
         """Save a single setting to database (Create or Update)"""
-        if not hasattr(self, key):
+        return await self.save_settings_bulk({key: value})
+
+    async def save_settings_bulk(self, changes: dict):
+        """Update several settings in memory and persist them in one transaction"""
+        changes = {k: v for k, v in changes.items() if k in _CASTERS}
+        if not changes:
             return False
-            
+        # Skip values that are unchanged from what is already stored
+        changes = {k: v for k, v in changes.items() if str(self._cache.get(k)) != str(v)}
+        if not changes:
+            return True
+
+        for key, value in changes.items():
+            setattr(self, key, value)
+        self._cache.update(changes)
+        if "TG_CHANNELS" in changes:
+            self._tg_channels_parsed = None
+
+        if not self._deferred_writes:
+            await self._persist_settings(changes)
+            return True
+
+        self._dirty_keys.update(changes)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+        return True
+
+    async def _persist_settings(self, changes: dict):
+        """Write settings to database in a single transaction (Upsert)"""
         async with async_session() as session:
-            # Check if key exists
-            result = await session.execute(select(SystemSettings).where(SystemSettings.key == key))
-            existing = result.scalar_one_or_none()
-            
-            if existing:
-                existing.value = str(value)
-            else:
-                session.add(SystemSettings(key=key, value=str(value)))
-                
+            stmt = sqlite_insert(SystemSettings)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[SystemSettings.key],
+                set_={"value": stmt.excluded.value}
+            )
+            await session.execute(stmt, [{"key": k, "value": str(v)} for k, v in changes.items()])
             await session.commit()
-            setattr(self, key, value)
+
+    async def _flush_dirty(self):
+        """Persist the current values of all dirty keys in one transaction"""
+        keys, self._dirty_keys = self._dirty_keys, set()
+        if not keys:
+            return True
+        try:
+            await asyncio.shield(self._persist_settings({k: self._cache[k] for k in keys}))
             return True
+        except Exception as e:
+            # Keep the keys dirty so the next save or shutdown retries them
+            logger.error(f"Failed to persist settings {sorted(keys)}: {e}")
+            self._dirty_keys |= keys
+            return False
+
+    async def _delayed_flush(self):
+        # Keep flushing while saves arrive during the previous write
+        while self._dirty_keys:
+            await asyncio.sleep(FLUSH_DELAY)
+            if not await self._flush_dirty():
+                break
+
+    def start_writer(self):
+        """Switch to deferred, coalesced settings writes"""
+        self._deferred_writes = True
+
+    async def stop_writer(self):
+        """Flush pending settings writes and go back to immediate writes"""
+        self._deferred_writes = False
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+        self._flush_task = None
+        await self._flush_dirty()
 
     class Config:
         env_file = ".env"
 
+def _parse_bool(value: str) -> bool:
+    return value.lower() == "true"
+
+# Setting name -> function turning its stored string back into the declared type
+# (None: stored as is); the schema is fixed so resolve it once
+_CASTERS = {
+    name: {int: int, float: float, bool: _parse_bool}.get(field.annotation)
+    for name, field in Settings.model_fields.items()
+}
+
 settings = Settings()
\ No newline at end of file
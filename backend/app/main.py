@@ -1,18 +1,21 @@
 import asyncio
 import logging
 import os
+import stat
 import sys
 from collections import deque
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from loguru import logger
+from cachetools import TTLCache
+import orjson
 
 from app.core.config import settings
-from app.api.config import router as config_router
-from app.api.auth import router as auth_router
+from app.api.config import router as config_router, close_proxy_test_session
+from app.api.auth import router as auth_router, AVATAR_DIR
 from app.api.excel import router as excel_router
 from app.services.tg_bot import tg_service
 from app.services.p115 import p115_service
@@ -36,42 +39,89 @@ log_level = getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO)
 logging.basicConfig(handlers=[InterceptHandler()], level=log_level, force=True)
 
 # WebSocket Log Broadcaster
+# Seconds a client may take to accept a log batch before it is dropped
+SEND_TIMEOUT = 1.0
+# Lines logged within this window go out together as one frame (a JSON array of lines)
+BATCH_INTERVAL = 0.05
+
 class LogBroadcast:
-    def __init__(self, max_history=100):
-        self.active_connections: list[WebSocket] = []
+    def __init__(self, max_history=100, max_pending=1000):
+        self.active_connections: set[WebSocket] = set()
         self.history = deque(maxlen=max_history)
         self.loop = None
+        self.queue: asyncio.Queue | None = None
+        self._max_pending = max_pending
+        self._drainer_task = None
+
+    def start(self):
+        """Bind to the running loop and start the batching drainer"""
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self._max_pending)
+        self._drainer_task = self.loop.create_task(self._drainer())
+
+    async def stop(self):
+        if self._drainer_task:
+            self._drainer_task.cancel()
+            try:
+                await self._drainer_task
+            except asyncio.CancelledError:
+                pass
+            self._drainer_task = None
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         # Send history first
-        for msg in self.history:
+        if self.history:
             try:
-                await websocket.send_text(msg)
+                await websocket.send_text(orjson.dumps(list(self.history)).decode())
             except Exception:
                 pass
-        self.active_connections.append(websocket)
-        if not self.loop:
-            self.loop = asyncio.get_running_loop()
+        self.active_connections.add(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        self.active_connections.discard(websocket)
 
     def broadcast(self, message: str):
         self.history.append(message)
-        if not self.loop or not self.active_connections:
+        if not self.queue or not self.active_connections:
             return
         
-        # Ensure we schedule the send task in the right loop
-        for connection in list(self.active_connections):
-            asyncio.run_coroutine_threadsafe(self._send_safe(connection, message), self.loop)
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        
+        if on_loop:
+            self._enqueue(message)
+        else:
+            # Logged from another thread: hand the line over to the loop
+            self.loop.call_soon_threadsafe(self._enqueue, message)
 
-    async def _send_safe(self, websocket: WebSocket, message: str):
+    def _enqueue(self, message: str):
         try:
-            await websocket.send_text(message)
-        except Exception:
-            self.disconnect(websocket)
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Clients can't keep up; the line is still in history for new connections
+            pass
+
+    async def _drainer(self):
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(BATCH_INTERVAL)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if self.active_connections:
+                await self._fanout(tuple(self.active_connections), orjson.dumps(batch).decode())
+
+    async def _fanout(self, connections: tuple[WebSocket, ...], message: str):
+        results = await asyncio.gather(
+            *(asyncio.wait_for(ws.send_text(message), timeout=SEND_TIMEOUT) for ws in connections),
+            return_exceptions=True
+        )
+        # Drop clients that errored or were too slow to take the message
+        for ws, result in zip(connections, results):
+            if isinstance(result, BaseException):
+                self.disconnect(ws)
 
 log_broadcast = LogBroadcast()
 
@@ -97,10 +147,12 @@ logger.add(
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    log_broadcast.start()
     logger.info(f"P115-Share API {VERSION} starting up...")
     
     # Init DB and migrate settings
     await settings.init_db()
+    settings.start_writer()
     
     # Re-initialize services with loaded settings
     from app.services.p115 import p115_service
@@ -131,7 +183,10 @@ async def lifespan(app: FastAPI):
     from app.services.excel_batch import excel_batch_service
     await excel_batch_service.shutdown()
     cleanup_scheduler.shutdown()
+    await close_proxy_test_session()
+    await settings.stop_writer()
     logger.info("P115-Share API shutting down...")
+    await log_broadcast.stop()
 
 app = FastAPI(
     title="P115-Share API",
@@ -153,33 +208,73 @@ app.include_router(auth_router, prefix="/api")
 app.include_router(config_router, prefix="/api")
 app.include_router(excel_router, prefix="/api")
 
+# Built frontend; unknown paths fall back to the SPA index
+STATIC_DIR = "static"
+INDEX_PATH = os.path.join(STATIC_DIR, "index.html")
+# Prefixes owned by the API and WebSocket routers
+RESERVED_PREFIXES = ("api/", "ws/")
+
 # Mount static files separately (highest priority for /static)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
-@app.get("/{full_path:path}")
-async def serve_frontend(full_path: str):
-    # API and WebSocket routes should be handled by their routers
-    if full_path.startswith("api/") or full_path.startswith("ws/"):
-        return {"detail": "Not Found"}
-    
-    # Path to static folder
-    static_dir = "static"
+# Uploaded avatars (content-hashed file names)
+os.makedirs(AVATAR_DIR, exist_ok=True)
+app.mount("/avatars", StaticFiles(directory=AVATAR_DIR), name="avatars")
+
+# Resolved frontend files: request path -> file path; short TTL picks up redeploys. Only the
+# lookup is cached, each response stats the file so size/etag always match the bytes sent
+_frontend_files: TTLCache = TTLCache(maxsize=256, ttl=5)
+
+def _resolve_frontend(full_path: str):
+    cached = _frontend_files.get(full_path)
+    if cached:
+        try:
+            st = os.stat(cached)
+        except OSError:
+            st = None
+        if st is not None and stat.S_ISREG(st.st_mode):
+            return cached, st
+        # Removed or replaced by a directory since it was cached: resolve again
+        _frontend_files.pop(full_path, None)
     
     # Try to find the actual file (strip 'static/' prefix if present in catch-all)
     lookup_path = full_path
     if lookup_path.startswith("static/"):
         lookup_path = lookup_path[7:]
-        
-    file_path = os.path.join(static_dir, lookup_path)
-    if os.path.isfile(file_path):
-        return FileResponse(file_path)
     
     # Default to index.html for SPA support if file not found
-    index_path = os.path.join(static_dir, "index.html")
-    if os.path.isfile(index_path):
-        return FileResponse(index_path)
+    for candidate in (os.path.join(STATIC_DIR, lookup_path), INDEX_PATH):
+        try:
+            st = os.stat(candidate)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            _frontend_files[full_path] = candidate
+            return candidate, st
+    return None
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Weak If-None-Match comparison: any listed tag (W/ prefix ignored) or * matches"""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags or "*" in tags
+
+@app.get("/{full_path:path}")
+async def serve_frontend(full_path: str, request: Request):
+    # API and WebSocket routes should be handled by their routers
+    if full_path.startswith(RESERVED_PREFIXES):
+        return {"detail": "Not Found"}
+    
+    resolved = _resolve_frontend(full_path)
+    if not resolved:
+        return {"detail": "Frontend not found"}
     
-    return {"detail": "Frontend not found"}
+    file_path, st = resolved
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"etag": etag})
+    return FileResponse(file_path, stat_result=st, headers={"etag": etag})
 
 @app.websocket("/ws/logs")
 async def websocket_endpoint(websocket: WebSocket):
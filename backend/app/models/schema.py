@@ -1,16 +1,19 @@
 from datetime import datetime
-from sqlalchemy import String, Text, DateTime, Integer, Boolean, JSON
+from sqlalchemy import String, Text, DateTime, Integer, Boolean, JSON, Index, func
 from sqlalchemy.orm import Mapped, mapped_column
 from app.core.database import Base
 
+# Timestamps use func.now() (CURRENT_TIMESTAMP, UTC) rendered into the INSERT, so SQLite
+# stamps rows itself; a client-side default also works on tables created before this change
+
 class User(Base):
     __tablename__ = "users"
     
     id: Mapped[int] = mapped_column(primary_key=True)
     username: Mapped[str] = mapped_column(String(50), unique=True, index=True)
     hashed_password: Mapped[str] = mapped_column(String(255))
-    avatar_url: Mapped[str] = mapped_column(Text, default="/logo.png")  # Stores base64 data URI or path
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    avatar_url: Mapped[str] = mapped_column(Text, default="/logo.png")  # Stores served path (legacy rows may hold a base64 data URI)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
 
 class SystemSettings(Base):
     __tablename__ = "system_settings"
@@ -25,10 +28,10 @@ class PendingLink(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     share_url: Mapped[str] = mapped_column(String(255))
     metadata_json: Mapped[dict] = mapped_column(JSON)
-    status: Mapped[str] = mapped_column(String(20), default="auditing") # auditing, failed, completed
+    status: Mapped[str] = mapped_column(String(20), default="auditing", index=True) # auditing, failed, completed
     attempts: Mapped[int] = mapped_column(Integer, default=0)
-    last_check: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_check: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
 
 class LinkHistory(Base):
     __tablename__ = "link_history"
@@ -36,7 +39,7 @@ class LinkHistory(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     original_url: Mapped[str] = mapped_column(String(255), unique=True, index=True)
     share_link: Mapped[str] = mapped_column(Text)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
 
 class ExcelTask(Base):
     __tablename__ = "excel_tasks"
@@ -51,18 +54,23 @@ class ExcelTask(Base):
     interval_min: Mapped[int] = mapped_column(Integer, default=5)
     interval_max: Mapped[int] = mapped_column(Integer, default=10)
     skip_count: Mapped[int] = mapped_column(Integer, default=0)
+    dedup_count: Mapped[int] = mapped_column(Integer, default=0)  # Rows dropped at import as repeated links
     current_row: Mapped[int] = mapped_column(Integer, default=0)
     is_waiting: Mapped[bool] = mapped_column(Boolean, default=False)
     target_channels: Mapped[dict] = mapped_column(JSON, nullable=True)  # List of channel IDs to push to
     white_list_keywords: Mapped[str] = mapped_column(Text, nullable=True)  # Comma separated
     black_list_keywords: Mapped[str] = mapped_column(Text, nullable=True)  # Comma separated
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
 
 class ExcelTaskItem(Base):
     __tablename__ = "excel_task_items"
+    __table_args__ = (
+        # Serves "items of task X with status Y ordered by row" as a range scan
+        Index("ix_items_task_status_row", "task_id", "status", "row_index"),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
-    task_id: Mapped[int] = mapped_column(Integer, index=True)
+    task_id: Mapped[int] = mapped_column(Integer)  # served by ix_items_task_status_row
     row_index: Mapped[int] = mapped_column(Integer)
     original_url: Mapped[str] = mapped_column(String(255))
     title: Mapped[str] = mapped_column(String(255), nullable=True)
@@ -71,4 +79,4 @@ class ExcelTaskItem(Base):
     new_share_url: Mapped[str] = mapped_column(Text, nullable=True)
     error_msg: Mapped[str] = mapped_column(Text, nullable=True)
     item_metadata: Mapped[dict] = mapped_column(JSON, nullable=True)  # Store original message text and entities
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
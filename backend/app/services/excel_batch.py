@@ -1,48 +1,132 @@
 import asyncio
 import random
 import io
+import os
+import hashlib
+import codecs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+from typing import BinaryIO, Optional, Union
 from datetime import datetime
 from loguru import logger
-from sqlalchemy import select, update, delete, func
+from cachetools import TTLCache
+from sqlalchemy import select, insert, update, delete, func
 from app.core.database import async_session
 from app.models.schema import ExcelTask, ExcelTaskItem
 from app.services.p115 import p115_service
 from app.services.tg_bot import tg_service
 from app.core.config import settings
 
+# Upload parsing (pandas/openpyxl) is CPU bound; at most two parses run beside the event loop
+_PARSE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="excel-parse")
+
+# Pending items fetched per query by the worker
+PENDING_PAGE_SIZE = 50
+# Item rows per executemany when creating a task
+INSERT_BATCH_SIZE = 1000
+# CSV encodings tried in order, and how much of the file is sniffed to skip the UTF-8 ones
+CSV_ENCODINGS = ('utf-8', 'utf-8-sig', 'gbk', 'gb18030')
+CSV_SNIFF_BYTES = 64 * 1024
+
 class ExcelBatchService:
     def __init__(self):
         self.worker_task = None
         self.active_task_id = None
         self._lock = asyncio.Lock()
+        # Set by pause/cancel/shutdown to cut the worker's rate-limit wait short
+        self._wake = asyncio.Event()
+        # Set by the worker whenever it finishes an item (active_task_id back to None)
+        self._idle = asyncio.Event()
+        # Page of pending (item id, row_index) of the running task, claimed one by one
+        self._pending: deque = deque()
+        self._pending_task_id = None
+        # original_url -> history share link (None = no history) of fetched, not yet committed items
+        self._history: dict = {}
+        # Parsed uploads: preview parses the file, creating the task reuses the frame
+        self._df_cache: TTLCache = TTLCache(maxsize=8, ttl=600)
+        # Latest channel broadcast; each one waits for the previous so posts keep row order
+        self._broadcast_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _as_stream(content: Union[bytes, BinaryIO]) -> BinaryIO:
+        """Wrap raw bytes or rewind an uploaded file so it can be (re)read from the start"""
+        if isinstance(content, (bytes, bytearray)):
+            return io.BytesIO(content)
+        content.seek(0)
+        return content
 
-    def _read_csv(self, content: bytes):
+    def _read_csv(self, content: Union[bytes, BinaryIO]):
         """Try reading CSV with multiple encodings"""
-        for encoding in ['utf-8', 'utf-8-sig', 'gbk', 'gb18030']:
+        for encoding in self._csv_encodings(self._as_stream(content).read(CSV_SNIFF_BYTES)):
             try:
-                return pd.read_csv(io.BytesIO(content), encoding=encoding)
+                return pd.read_csv(self._as_stream(content), encoding=encoding)
             except UnicodeDecodeError:
                 continue
             except Exception as e:
                 raise e
         raise Exception("无法识别CSV文件编码，请确保文件是 UTF-8 或 GBK 格式")
 
-    async def parse_file(self, content: bytes, filename: str):
+    @staticmethod
+    def _csv_encodings(head: bytes) -> tuple:
+        """Encodings worth trying for a CSV starting with head; a non-UTF-8 head skips the UTF-8 parses"""
+        try:
+            # Not final: the sniffed block may end inside a multi-byte character
+            codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+            return CSV_ENCODINGS
+        except UnicodeDecodeError:
+            return tuple(e for e in CSV_ENCODINGS if not e.startswith('utf-8'))
+
+    def _read_excel(self, content: Union[bytes, BinaryIO]):
+        """Read xlsx/xls with the Rust calamine engine, falling back to pandas' default engine"""
+        try:
+            return pd.read_excel(self._as_stream(content), engine="calamine")
+        except (ImportError, ValueError) as e:
+            logger.debug(f"calamine 读取失败，回退默认引擎: {e}")
+            return pd.read_excel(self._as_stream(content))
+
+    @classmethod
+    def _content_key(cls, content: Union[bytes, BinaryIO], filename: str) -> tuple:
+        """Cache key for an upload: content digest plus the extension that picks the parser"""
+        digest = hashlib.blake2b(digest_size=16)
+        stream = cls._as_stream(content)
+        while chunk := stream.read(1024 * 1024):
+            digest.update(chunk)
+        return digest.hexdigest(), os.path.splitext(filename)[1].lower()
+
+    def _parse_upload(self, content: Union[bytes, BinaryIO], filename: str) -> pd.DataFrame:
+        if filename.endswith('.json'):
+            data = self._parse_telegram_json(content)
+            return pd.DataFrame(data)
+        elif filename.endswith('.csv'):
+            return self._read_csv(content)
+        else:
+            return self._read_excel(content)
+
+    async def _load_dataframe(self, content: Union[bytes, BinaryIO], filename: str, consume: bool = False) -> pd.DataFrame:
+        """Parse an upload into a DataFrame, reusing the result of an earlier parse of the same file"""
+        # Hashing and parsing are blocking, run them on the capped parse pool
+        loop = asyncio.get_running_loop()
+        key = await loop.run_in_executor(_PARSE_EXECUTOR, self._content_key, content, filename)
+        df = self._df_cache.pop(key, None) if consume else self._df_cache.get(key)
+        if df is not None:
+            return df
+        
+        df = await loop.run_in_executor(_PARSE_EXECUTOR, self._parse_upload, content, filename)
+        if not consume:
+            self._df_cache[key] = df
+        return df
+
+    async def parse_file(self, content: Union[bytes, BinaryIO], filename: str):
         """Parse Excel/CSV/JSON file and return headers and sample data"""
         try:
-            if filename.endswith('.json'):
-                data = self._parse_telegram_json(content)
-                df = pd.DataFrame(data)
-            elif filename.endswith('.csv'):
-                df = self._read_csv(content)
-            else:
-                df = pd.read_excel(io.BytesIO(content))
+            df = await self._load_dataframe(content, filename)
             
             headers = df.columns.tolist()
-            # Convert NaN to None for JSON serialization
-            df_cleaned = df.where(pd.notnull(df), None)
-            preview_data = df_cleaned.head(5).to_dict(orient='records')
+            # Convert NaN to None for JSON serialization (only the preview rows are copied)
+            preview = df.head(5).astype(object)
+            # Rows as value lists in header order (like orient='split'), so column names aren't repeated per row
+            preview_data = preview.where(preview.notna(), None).to_numpy().tolist()
             
             return {
                 "headers": headers,
@@ -71,13 +155,13 @@ class ExcelBatchService:
         'spoiler': lambda t: t,
     }
 
-    def _parse_telegram_json(self, content: bytes):
+    def _parse_telegram_json(self, content: Union[bytes, BinaryIO]):
         """Parse Telegram export JSON and extract links, titles, and original message format"""
         import json
         import re
         
         try:
-            data = json.loads(content)
+            data = json.load(self._as_stream(content))
             messages = data.get('messages', [])
             extracted_data = []
             
@@ -177,18 +261,11 @@ class ExcelBatchService:
             logger.exception(f"解析 Telegram JSON 失败")
             raise Exception(f"解析 Telegram JSON 失败: {str(e)}")
 
-    async def create_task(self, filename: str, mapping: dict, content: bytes):
+    async def create_task(self, filename: str, mapping: dict, content: Union[bytes, BinaryIO]):
         """Create task and items based on mapping"""
         try:
-            if filename.endswith('.json'):
-                data = self._parse_telegram_json(content)
-                df = pd.DataFrame(data)
-            elif filename.endswith('.csv'):
-                df = self._read_csv(content)
-            else:
-                df = pd.read_excel(io.BytesIO(content))
-            
-            df = df.where(pd.notnull(df), None)
+            # The preview step usually parsed this exact upload already
+            df = await self._load_dataframe(content, filename, consume=True)
             
             link_col = mapping.get('link')
             title_col = mapping.get('title')
@@ -197,27 +274,39 @@ class ExcelBatchService:
             if not link_col:
                 raise Exception("未指定链接列")
 
+            # Column extraction and dedupe run on the parse pool, off the event loop
+            entries = await asyncio.get_running_loop().run_in_executor(
+                _PARSE_EXECUTOR, self._item_entries, df, link_col, title_col, code_col
+            )
+            dedup_count = len(df) - len(entries)
+            if dedup_count:
+                logger.info(f"Excel 任务 {filename}: 去除重复链接 {dedup_count} 行")
+
             async with async_session() as session:
                 task = ExcelTask(
                     name=filename,
                     status="wait",
-                    total_count=len(df)
+                    total_count=len(entries),
+                    dedup_count=dedup_count
                 )
                 session.add(task)
                 await session.flush()
                 
-                # Add items
-                for idx, row in df.iterrows():
-                    item = ExcelTaskItem(
-                        task_id=task.id,
-                        row_index=int(idx) + 1,
-                        original_url=str(row[link_col]) if row[link_col] else "",
-                        title=str(row[title_col]) if title_col and row[title_col] else None,
-                        extraction_code=str(row[code_col]) if code_col and row[code_col] else None,
-                        item_metadata=row.get('item_metadata') if 'item_metadata' in row else None,
-                        status="待处理"
-                    )
-                    session.add(item)
+                # Add items with executemany (multi-row INSERTs), building the row dicts a slice at a time
+                for start in range(0, len(entries), INSERT_BATCH_SIZE):
+                    rows = [
+                        {
+                            "task_id": task.id,
+                            "row_index": row_index,
+                            "original_url": url,
+                            "title": title,
+                            "extraction_code": code,
+                            "item_metadata": meta,
+                            "status": "待处理",
+                        }
+                        for row_index, url, title, code, meta in entries[start:start + INSERT_BATCH_SIZE]
+                    ]
+                    await session.execute(insert(ExcelTaskItem), rows)
                 
                 await session.commit()
                 return task.id
@@ -225,126 +314,205 @@ class ExcelBatchService:
             logger.error(f"创建任务失败: {e}")
             raise e
 
+    @classmethod
+    def _item_entries(cls, df: pd.DataFrame, link_col, title_col, code_col) -> list:
+        """(row_index, url, title, code, metadata) per row to import, repeated links dropped"""
+        # Build item columns vectorized instead of walking df.iterrows()
+        row_indexes = (df.index + 1).tolist()
+        urls = cls._text_column(df, link_col, "")
+        titles = cls._text_column(df, title_col, None)
+        codes = cls._text_column(df, code_col, None)
+        if 'item_metadata' in df.columns:
+            metadata = df['item_metadata'].where(df['item_metadata'].notna(), None).tolist()
+        else:
+            metadata = [None] * len(df)
+        
+        # Repeated links are only processed once (first row wins); empty links stay to be reported
+        url_series = pd.Series(urls)
+        keep = ~(url_series.duplicated(keep="first") & url_series.ne("")).to_numpy()
+        return [
+            entry for keep_row, *entry in zip(keep, row_indexes, urls, titles, codes, metadata) if keep_row
+        ]
+
+    @staticmethod
+    def _text_column(df: pd.DataFrame, col, default):
+        """Column as a list of str, with empty/null cells replaced by default"""
+        if not col:
+            return [default] * len(df)
+        values = df[col]
+        keep = values.notna() & values.astype(bool)
+        # object first: masking a pandas string column fills NaN instead of default
+        return values.astype(str).astype(object).where(keep, default).tolist()
+
     async def start_worker(self):
         if self.worker_task and not self.worker_task.done():
             return
         self.worker_task = asyncio.create_task(self._worker())
         logger.info("Excel 批量转存服务工作线程启动")
 
+    async def _wait_or_wake(self, seconds: float):
+        """Sleep between items; returns early once the worker is woken by a status change"""
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _wait_idle(self, task_id: Optional[int], timeout: float) -> bool:
+        """Wait until the worker is done with task_id's current item (any task if None); False on timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.active_task_id is not None and task_id in (None, self.active_task_id):
+            self._idle.clear()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def _next_running_task(self):
+        """Return (id, interval_min, interval_max) of the running task, promoting a queued one if needed"""
+        async with async_session() as session:
+            columns = (ExcelTask.id, ExcelTask.name, ExcelTask.interval_min, ExcelTask.interval_max)
+            task = (await session.execute(
+                select(*columns).where(ExcelTask.status == "running").limit(1)
+            )).one_or_none()
+            
+            if not task:
+                # If no running task, check for "queued" tasks
+                task = (await session.execute(
+                    select(*columns).where(ExcelTask.status == "queued").order_by(ExcelTask.created_at).limit(1)
+                )).one_or_none()
+                if task:
+                    # Start the queued task
+                    await session.execute(update(ExcelTask).where(ExcelTask.id == task.id).values(status="running"))
+                    await session.commit()
+                    logger.info(f"队列任务 {task.id} ({task.name}) 开始运行")
+        
+        return (task.id, task.interval_min, task.interval_max) if task else None
+
+    async def _fill_pending(self, task_id: int):
+        """Load the next page of pending (id, row_index) pairs of a task, plus the page's link history"""
+        async with async_session() as session:
+            result = await session.execute(
+                select(ExcelTaskItem.id, ExcelTaskItem.row_index, ExcelTaskItem.original_url).where(
+                    ExcelTaskItem.task_id == task_id,
+                    ExcelTaskItem.status == "待处理"
+                ).order_by(ExcelTaskItem.row_index).limit(PENDING_PAGE_SIZE)
+            )
+            rows = result.all()
+        self._pending = deque((item_id, row_index) for item_id, row_index, _ in rows)
+        
+        # One lookup for the whole page; urls without history map to None. Merge rather than
+        # replace: the item in flight while the next page loads still needs its entry
+        urls = [url for _, _, url in rows if url]
+        history = await p115_service.get_history_links(urls) if urls else {}
+        if history is not None:
+            self._history.update({url: history.get(url) for url in urls})
+
+    def _drop_page(self):
+        """Forget the cached pending page and its prefetched history"""
+        self._pending.clear()
+        self._history.clear()
+
     async def _worker(self):
+        task = None
         while True:
             try:
                 item_id = None
-                # Check for tasks that are "running"
-                async with async_session() as session:
-                    result = await session.execute(
-                        select(ExcelTask).where(ExcelTask.status == "running").limit(1)
-                    )
-                    task = result.scalar_one_or_none()
-                    
-                    if not task:
-                        # If no running task, check for "queued" tasks
-                        result = await session.execute(
-                            select(ExcelTask).where(ExcelTask.status == "queued").order_by(ExcelTask.created_at).limit(1)
-                        )
-                        task = result.scalar_one_or_none()
-                        if task:
-                            # Start the queued task
-                            task.status = "running"
-                            await session.commit()
-                            logger.info(f"队列任务 {task.id} ({task.name}) 开始运行")
+                progress = None
+                # Status changed (pause/cancel/shutdown): re-read the task and drop the cached page
+                woken = self._wake.is_set()
+                self._wake.clear()
+                if woken or not self._pending or task is None:
+                    task = await self._next_running_task()
+                    if woken or (task and task[0] != self._pending_task_id):
+                        self._drop_page()
                 
-                    if not task:
-                        # If no running taskFound, exit worker
-                        logger.info("Excel 批量转存服务工作线程退出（无运行中的任务）")
-                        self.worker_task = None
-                        break
+                if not task:
+                    # If no running taskFound, exit worker
+                    logger.info("Excel 批量转存服务工作线程退出（无运行中的任务）")
+                    self._drop_page()
+                    self.worker_task = None
+                    break
+                
+                task_id, interval_min, interval_max = task
+                self.active_task_id = task_id
+                
+                try:
+                    if not self._pending:
+                        self._pending_task_id = task_id
+                        await self._fill_pending(task_id)
                     
-                    self.active_task_id = task.id
-                    interval_min = task.interval_min
-                    interval_max = task.interval_max
+                    if self._pending and p115_service.is_restricted:
+                        # Leave the next item pending (unclaimed) and look again later
+                        logger.info(f"⏳ P115 服务当前处于受限状态，批量任务 {task_id} 暂停等待...")
+                        await self._wait_or_wake(600)  # 等待 10 分钟再重看
+                        continue
                     
-                    try:
-                        # Get one pending item
-                        async with async_session() as session:
-                            result = await session.execute(
-                                select(ExcelTaskItem).where(
-                                    ExcelTaskItem.task_id == task.id,
-                                    ExcelTaskItem.status == "待处理"
-                                ).order_by(ExcelTaskItem.row_index).limit(1)
-                            )
-                            item = result.scalar_one_or_none()
-                            
-                            if item:
-                                item.status = "处理中"
-                                item_id = item.id
-                                # Update current_row in ExcelTask and set is_waiting to False
-                                await session.execute(
-                                    update(ExcelTask).where(ExcelTask.id == task.id).values(
-                                        current_row=item.row_index,
-                                        is_waiting=False
-                                    )
-                                )
-                                await session.commit()
-                            else:
-                                # No more pending items for this task
-                                await session.execute(
-                                    update(ExcelTask).where(ExcelTask.id == task.id).values(
-                                        status="completed", 
-                                        current_row=0,
-                                        is_waiting=False
-                                    )
+                    async with async_session() as session:
+                        if not self._pending:
+                            # No more pending items for this task
+                            await session.execute(
+                                update(ExcelTask).where(ExcelTask.id == task_id).values(
+                                    status="completed", 
+                                    current_row=0,
+                                    is_waiting=False
                                 )
-                                await session.commit()
-                                self.active_task_id = None
-                                continue
-
-                        # Process the item
-                        if p115_service.is_restricted:
-                            logger.info(f"⏳ P115 服务当前处于受限状态，批量任务 {task.id} 暂停等待...")
-                            # 将 item 状态改回待处理，以便稍后重试
-                            async with async_session() as session:
-                                await session.execute(
-                                    update(ExcelTaskItem).where(ExcelTaskItem.id == item_id).values(status="待处理")
-                                )
-                                await session.commit()
-                            await asyncio.sleep(600)  # 等待 10 分钟再重看
+                            )
+                            await session.commit()
+                            self.active_task_id = None
+                            task = None
                             continue
-
-                        await self._process_item(item_id)
                         
-                    finally:
-                        # Find next row and set is_waiting to True before sleep
-                        if item_id:
-                            async with async_session() as session:
-                                # Look ahead for next pending item
-                                next_result = await session.execute(
-                                    select(ExcelTaskItem.row_index).where(
-                                        ExcelTaskItem.task_id == task.id,
-                                        ExcelTaskItem.status == "待处理"
-                                    ).order_by(ExcelTaskItem.row_index).limit(1)
-                                )
-                                next_row = next_result.scalar_one_or_none()
-                                
-                                if next_row:
-                                    await session.execute(
-                                        update(ExcelTask).where(ExcelTask.id == task.id).values(
-                                            current_row=next_row,
-                                            is_waiting=True
-                                        )
-                                    )
-                                else:
-                                    await session.execute(
-                                        update(ExcelTask).where(ExcelTask.id == task.id).values(
-                                            current_row=0,
-                                            is_waiting=False
-                                        )
-                                    )
-                                await session.commit()
-                        self.active_task_id = None
-                
-                # Rate limiting (Random interval)
+                        # Claim the next cached item; skip it if it is no longer pending
+                        pending_id, row_index = self._pending.popleft()
+                        claimed = await session.execute(
+                            update(ExcelTaskItem).where(
+                                ExcelTaskItem.id == pending_id,
+                                ExcelTaskItem.status == "待处理"
+                            ).values(status="处理中")
+                        )
+                        if claimed.rowcount == 0:
+                            continue
+                        item_id = pending_id
+                        # Update current_row in ExcelTask and set is_waiting to False
+                        await session.execute(
+                            update(ExcelTask).where(ExcelTask.id == task_id).values(
+                                current_row=row_index,
+                                is_waiting=False
+                            )
+                        )
+                        await session.commit()
 
+                    # Look ahead now so the next row is recorded in the same commit as this result.
+                    # The item is already claimed: a failed look-ahead must not keep it from running
+                    if not self._pending:
+                        try:
+                            await self._fill_pending(task_id)
+                        except Exception as e:
+                            logger.error(f"预取待处理条目失败: {e}")
+                            self._pending.clear()
+                    next_row = self._pending[0][1] if self._pending else None
+                    progress = {"current_row": next_row or 0, "is_waiting": bool(next_row)}
+                    
+                    # Process the item
+                    if await self._process_item(item_id, progress):
+                        progress = None
+                    
+                finally:
+                    # Result wasn't committed (error / item gone): still move the task on to the next row
+                    if item_id and progress:
+                        async with async_session() as session:
+                            await session.execute(
+                                update(ExcelTask).where(ExcelTask.id == task_id).values(**progress)
+                            )
+                            await session.commit()
+                    self.active_task_id = None
+                    self._idle.set()
+                
                 # Rate limiting (Random interval) with capacity check
                 interval = random.randint(interval_min, interval_max)
                 
@@ -361,15 +529,18 @@ class ExcelBatchService:
                 remaining_sleep = interval - elapsed
                 
                 if remaining_sleep > 0:
-                    await asyncio.sleep(remaining_sleep)
+                    await self._wait_or_wake(remaining_sleep)
                 else:
                     logger.debug(f"容量检查耗时 {elapsed:.2f}s > 间隔 {interval}s，跳过额外等待")
                 
             except Exception as e:
                 logger.error(f"Excel 工作线程出错: {e}")
+                self._drop_page()
+                task = None
                 await asyncio.sleep(5)
 
-    async def _process_item(self, item_id: int):
+    async def _process_item(self, item_id: int, progress: dict = None) -> bool:
+        """Process one claimed item; returns True once its result (and progress) is committed"""
         async with async_session() as session:
             # Query Item and Task together to get target_channels and keywords
             result = await session.execute(
@@ -390,7 +561,7 @@ class ExcelBatchService:
                 black_list = row[3]
             except Exception:
                 logger.error(f"Item {item_id} not found or task deleted")
-                return
+                return False
 
             task_id = item.task_id
             
@@ -409,9 +580,8 @@ class ExcelBatchService:
                         logger.info(f"Item {item.id} skipped (Blacklist match: {kw})")
                         item.status = "跳过"
                         item.error_msg = f"命中黑名单关键词: {kw}"
-                        await session.commit()
-                        await self._update_task_counts(task_id)
-                        return
+                        await self._commit_result(session, item, progress)
+                        return True
             
             # 2. Check Whitelist
             if white_list:
@@ -427,33 +597,33 @@ class ExcelBatchService:
                         logger.info(f"Item {item.id} skipped (Whitelist no match)")
                         item.status = "跳过"
                         item.error_msg = "未命中白名单关键词"
-                        await session.commit()
-                        await self._update_task_counts(task_id)
-                        return
+                        await self._commit_result(session, item, progress)
+                        return True
             # --- End Filtering Logic ---
             
             original_url = item.original_url
             if not original_url:
                 item.status = "失败"
                 item.error_msg = "链接为空"
-                await session.commit()
-                await self._update_task_counts(task_id)
-                return
+                await self._commit_result(session, item, progress)
+                return True
 
-            # 1. Check history first
-            history_url = await p115_service.get_history_link(original_url)
+            # 1. Check history first (prefetched with the page; query only for urls outside it)
+            if original_url in self._history:
+                history_url = self._history[original_url]
+            else:
+                history_url = await p115_service.get_history_link(original_url)
             if history_url:
                 item.status = "成功"
                 import json
                 item.new_share_url = json.dumps(history_url) if isinstance(history_url, list) else history_url
-                await session.commit()
-                await self._update_task_counts(task_id)
+                await self._commit_result(session, item, progress)
                 if tg_service:
                     if item.item_metadata:
-                        await tg_service.broadcast_to_channels({original_url: history_url}, item.item_metadata, channel_ids=target_channels)
+                        self._broadcast_later({original_url: history_url}, item.item_metadata, channel_ids=target_channels)
                     else:
-                        await tg_service.broadcast_to_channels({original_url: history_url}, {"full_text": f"资源名称：{item.title or '未知'}\n分享链接：{{{{share_link}}}}"}, channel_ids=target_channels)
-                return
+                        self._broadcast_later({original_url: history_url}, {"full_text": f"资源名称：{item.title or '未知'}\n分享链接：{{{{share_link}}}}"}, channel_ids=target_channels)
+                return True
 
             try:
                 # Prepare metadata for broadcasting
@@ -502,9 +672,9 @@ class ExcelBatchService:
                             # Broadcast to channels
                             if tg_service:
                                 if item.item_metadata:
-                                    await tg_service.broadcast_to_channels({original_url: all_links}, metadata, channel_ids=target_channels)
+                                    self._broadcast_later({original_url: all_links}, metadata, channel_ids=target_channels)
                                 else:
-                                    await tg_service.broadcast_to_channels({original_url: all_links}, {"full_text": f"资源名称：{item.title or '未知'}\n分享链接：{{{{share_link}}}}"}, channel_ids=target_channels)
+                                    self._broadcast_later({original_url: all_links}, {"full_text": f"资源名称：{item.title or '未知'}\n分享链接：{{{{share_link}}}}"}, channel_ids=target_channels)
                         else:
                             item.status = "失败"
                             item.error_msg = "转存成功但生成分享链接返回为空"
@@ -522,30 +692,51 @@ class ExcelBatchService:
                 item.status = "失败"
                 item.error_msg = str(e)
             
-            await session.commit()
-            await self._update_task_counts(task_id)
+            await self._commit_result(session, item, progress)
+            return True
+
+    def _broadcast_later(self, share_links_map: dict, metadata: dict, channel_ids: list = None):
+        """Push to the channels in the background so the rate-limit wait overlaps the Telegram sends"""
+        previous = self._broadcast_task
+        
+        async def run():
+            if previous:
+                await asyncio.wait([previous])
+            try:
+                await tg_service.broadcast_to_channels(share_links_map, metadata, channel_ids=channel_ids)
+            except Exception as e:
+                logger.error(f"批量任务频道推送失败: {e}")
+        
+        self._broadcast_task = asyncio.create_task(run())
+
+    async def _commit_result(self, session, item: ExcelTaskItem, progress: dict = None):
+        """Commit a finished item together with the task counter increment and progress (current_row/is_waiting)"""
+        values = dict(progress or {})
+        if item.status == "成功":
+            values["success_count"] = ExcelTask.success_count + 1
+        elif item.status == "失败":
+            values["fail_count"] = ExcelTask.fail_count + 1
+        if values:
+            await session.execute(update(ExcelTask).where(ExcelTask.id == item.task_id).values(**values))
+        await session.commit()
+        # Committed: its prefetched history is no longer needed (a repeated url re-reads the
+        # saved history from the database instead of a stale prefetched miss)
+        self._history.pop(item.original_url, None)
 
     async def _update_task_counts(self, task_id: int):
+        """Recount success/fail counters from the items (after a reset)"""
+        def status_count(status: str):
+            # Range count on ix_items_task_status_row
+            return select(func.count()).where(
+                ExcelTaskItem.task_id == task_id,
+                ExcelTaskItem.status == status
+            ).scalar_subquery()
+        
         async with async_session() as session:
-            # Get success count
-            success_count = await session.scalar(
-                select(func.count(ExcelTaskItem.id)).where(
-                    ExcelTaskItem.task_id == task_id, 
-                    ExcelTaskItem.status == "成功"
-                )
-            )
-            # Get fail count
-            fail_count = await session.scalar(
-                select(func.count(ExcelTaskItem.id)).where(
-                    ExcelTaskItem.task_id == task_id, 
-                    ExcelTaskItem.status == "失败"
-                )
-            )
-            
             await session.execute(
                 update(ExcelTask).where(ExcelTask.id == task_id).values(
-                    success_count=success_count,
-                    fail_count=fail_count
+                    success_count=status_count("成功"),
+                    fail_count=status_count("失败")
                 )
             )
             await session.commit()
@@ -557,10 +748,9 @@ class ExcelBatchService:
             task = result.scalar_one()
             
             # Check if another task is already running
-            result = await session.execute(
-                select(ExcelTask).where(ExcelTask.status == "running", ExcelTask.id != task_id)
-            )
-            other_running = result.scalar_one_or_none()
+            other_running = (await session.execute(
+                select(ExcelTask.id).where(ExcelTask.status == "running", ExcelTask.id != task_id).limit(1)
+            )).scalar()
             
             new_status = "queued" if other_running else "running"
             
@@ -620,14 +810,15 @@ class ExcelBatchService:
                 ).values(status="paused", is_waiting=False)
             )
             await session.commit()
+        self._wake.set()
         
         # Wait for current processing item if any
-        wait_start = datetime.now()
-        while self.active_task_id is not None:
-            await asyncio.sleep(0.1)
-            if (datetime.now() - wait_start).total_seconds() > 30:
-                logger.warning("Excel shutdown wait timeout")
-                break
+        if not await self._wait_idle(None, 30):
+            logger.warning("Excel shutdown wait timeout")
+        
+        # Let queued channel broadcasts go out
+        if self._broadcast_task:
+            await asyncio.wait([self._broadcast_task], timeout=30)
         
         logger.info("Excel 批量转存服务已关闭")
 
@@ -639,14 +830,11 @@ class ExcelBatchService:
                 update(ExcelTask).where(ExcelTask.id == task_id).values(status="pausing")
             )
             await session.commit()
+        self._wake.set()
         
         # Safety wait: wait until the current item processing finishes
-        wait_start = datetime.now()
-        while self.active_task_id == task_id:
-            await asyncio.sleep(0.1)
-            if (datetime.now() - wait_start).total_seconds() > 60:
-                logger.warning(f"Pause task {task_id} safety wait timeout")
-                break
+        if not await self._wait_idle(task_id, 60):
+            logger.warning(f"Pause task {task_id} safety wait timeout")
         
         # Set to final status
         async with async_session() as session:
@@ -663,13 +851,10 @@ class ExcelBatchService:
                 update(ExcelTask).where(ExcelTask.id == task_id).values(status="cancelling")
             )
             await session.commit()
+        self._wake.set()
             
         # Safety wait: same as pause
-        wait_start = datetime.now()
-        while self.active_task_id == task_id:
-            await asyncio.sleep(0.1)
-            if (datetime.now() - wait_start).total_seconds() > 60:
-                break
+        await self._wait_idle(task_id, 60)
         
         # Set to final status
         async with async_session() as session:
@@ -1180,28 +1180,45 @@ class P115Service:
         await self._cleanup_save_directory_internal()
         await self._cleanup_recycle_bin_internal()
 
+    @staticmethod
+    def _decode_history_link(link_val: str) -> Union[str, list[str]]:
+        # Multi-volume shares are stored as a JSON list
+        if link_val.startswith("[") and link_val.endswith("]"):
+            try:
+                import json
+                return json.loads(link_val)
+            except:
+                return link_val
+        return link_val
+
     async def get_history_link(self, original_url: str) -> Optional[Union[str, list[str]]]:
         try:
-            import json
-            from app.models.schema import LinkHistory
             async with async_session() as session:
                 result = await session.execute(
                     select(LinkHistory).where(LinkHistory.original_url == original_url)
                 )
                 record = result.scalar_one_or_none()
                 if record:
-                    link_val = record.share_link
-                    if link_val.startswith("[") and link_val.endswith("]"):
-                        try:
-                            return json.loads(link_val)
-                        except:
-                            return link_val
-                    return link_val
+                    return self._decode_history_link(record.share_link)
             return None
         except Exception as e:
             logger.error(f"查询历史记录失败: {e}")
             return None
 
+    async def get_history_links(self, original_urls: list[str]) -> Optional[Dict[str, Union[str, list[str]]]]:
+        """Batch form of get_history_link: {original_url: share link} for the urls that have history, None on error"""
+        try:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(LinkHistory.original_url, LinkHistory.share_link).where(
+                        LinkHistory.original_url.in_(set(original_urls))
+                    )
+                )
+                return {url: self._decode_history_link(link_val) for url, link_val in result}
+        except Exception as e:
+            logger.error(f"查询历史记录失败: {e}")
+            return None
+
     async def save_history_link(self, original_url: str, share_link: Union[str, list[str]]):
         try:
             import json
@@ -17,9 +17,18 @@ class TGService:
         self._lock = asyncio.Lock()
         self._current_polling_id = 0
         self._verify_tasks = []
+        # Strong refs to fire-and-forget tasks, the loop only keeps weak ones
+        self._background_tasks = set()
         if settings.TG_BOT_TOKEN:
             self.init_bot(settings.TG_BOT_TOKEN)
 
+    def _spawn(self, coro) -> asyncio.Task:
+        """Run a coroutine in the background, keeping the task referenced until it finishes"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
     def init_bot(self, token: str):
         """Synchronous initialization for startup or immediate use."""
         try:
@@ -34,7 +43,7 @@ class TGService:
                 
             self.bot = Bot(token=token, session=session)
             # 设置命令菜单
-            asyncio.create_task(self.set_commands())
+            self._spawn(self.set_commands())
             self.dp = Dispatcher()
             self._register_handlers()
             logger.info("Telegram Bot initialized successfully")
@@ -279,7 +288,7 @@ class TGService:
                         reason = save_res.get("reason", "auditing")
                         if reason == "snapshotting" and total_links == 1:
                             await status_msg.edit_text("🔍 分享链接正在生成快照，请稍后，系统将自动重试处理")
-                        asyncio.create_task(self.poll_pending_link(message, save_res))
+                        self._spawn(self.poll_pending_link(message, save_res))
                         return "pending", None
                     elif save_res.get("status") == "error":
                         error_type = save_res.get("error_type")
@@ -702,12 +711,7 @@ class TGService:
             return None
 
     async def broadcast_to_channels(self, share_links_map: dict, metadata: dict, channel_ids: list = None):
-        import json
-        channels = []
-        try:
-            channels = json.loads(settings.TG_CHANNELS)
-        except Exception:
-            pass
+        channels = settings.tg_channels_parsed
         legacy_id = settings.TG_CHANNEL_ID
         if legacy_id and not any(c.get("id") == str(legacy_id) for c in channels):
             channels.append({"id": str(legacy_id), "enabled": True, "concise": False})
@@ -755,7 +759,7 @@ class TGService:
                         "db_id": task.id,
                         "reason": task.status
                     }
-                    asyncio.create_task(self._recovered_poll(pending_info))
+                    self._spawn(self._recovered_poll(pending_info))
 
     async def _recovered_poll(self, pending_info: dict):
         class MockMessage:
@@ -818,6 +822,10 @@ class TGService:
             await asyncio.sleep(2)
             self.polling_task = asyncio.create_task(self.start_polling())
 
+    def schedule_restart(self) -> asyncio.Task:
+        """Restart polling in the background (e.g. after a config change)"""
+        return self._spawn(self.restart_polling())
+
     async def test_send_to_user(self):
         if not self.bot or not settings.TG_USER_ID: return False, "未配置"
         try:
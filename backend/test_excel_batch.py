@@ -0,0 +1,129 @@
+import asyncio
+
+import pandas as pd
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+# The service imports the 115 client, which is installed from local source
+excel_batch = pytest.importorskip("app.services.excel_batch", exc_type=ImportError)
+import app.services.p115 as p115_module
+from app.core.database import Base
+from app.models.schema import ExcelTask, ExcelTaskItem, LinkHistory
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    """Point the batch service (and the history lookups it makes) at a throwaway SQLite file"""
+    # NullPool: every test runs its own event loop, pooled aiosqlite connections can't cross loops
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'p115share.db'}", poolclass=NullPool)
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create_tables())
+    factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    monkeypatch.setattr(excel_batch, "async_session", factory)
+    monkeypatch.setattr(p115_module, "async_session", factory)
+    return factory
+
+
+def _add_task(session_factory, statuses, **task_values):
+    """Insert a task with one item per status (row_index 1..n), return the task id"""
+    async def add():
+        async with session_factory() as session:
+            task = ExcelTask(name="t.xlsx", total_count=len(statuses), **task_values)
+            session.add(task)
+            await session.flush()
+            await session.execute(insert(ExcelTaskItem), [
+                {"task_id": task.id, "row_index": i, "original_url": f"https://115.com/s/{task.id}-{i}", "status": status}
+                for i, status in enumerate(statuses, start=1)
+            ])
+            await session.commit()
+            return task.id
+
+    return asyncio.run(add())
+
+
+def _fetch(session_factory, stmt):
+    async def fetch():
+        async with session_factory() as session:
+            return (await session.execute(stmt)).all()
+
+    return asyncio.run(fetch())
+
+
+def test_create_task_drops_repeated_links(session_factory):
+    content = "链接,标题\na,A\nb,B\na,A again\n,empty 1\n,empty 2\nc,C\n".encode("utf-8")
+    service = excel_batch.ExcelBatchService()
+
+    task_id = asyncio.run(service.create_task("t.csv", {"link": "链接", "title": "标题"}, content))
+
+    assert _fetch(session_factory, select(ExcelTask.total_count, ExcelTask.dedup_count)) == [(5, 1)]
+    items = _fetch(session_factory, select(ExcelTaskItem.row_index, ExcelTaskItem.original_url, ExcelTaskItem.title)
+                   .where(ExcelTaskItem.task_id == task_id).order_by(ExcelTaskItem.row_index))
+    # First occurrence wins and keeps its sheet row; empty links are kept to be reported as failures
+    assert items == [(1, "a", "A"), (2, "b", "B"), (4, "", "empty 1"), (5, "", "empty 2"), (6, "c", "C")]
+
+
+def test_item_entries_maps_blank_title_and_code_cells_to_none():
+    df = pd.DataFrame({
+        "链接": ["a", "b", "c", "d"],
+        "标题": ["A", "", None, float("nan")],
+        "提取码": [2, "b", "", None],
+    })
+
+    entries = excel_batch.ExcelBatchService._item_entries(df, "链接", "标题", "提取码")
+
+    assert [entry[2:4] for entry in entries] == [["A", "2"], [None, "b"], [None, None], [None, None]]
+
+
+def test_update_task_counts_recounts_from_items(session_factory):
+    task_id = _add_task(session_factory, ["成功", "失败", "成功", "跳过", "待处理", "处理中"], success_count=9, fail_count=9)
+    other_id = _add_task(session_factory, ["成功", "失败", "失败"])
+
+    asyncio.run(excel_batch.ExcelBatchService()._update_task_counts(task_id))
+
+    counts = dict((row[0], row[1:]) for row in _fetch(
+        session_factory, select(ExcelTask.id, ExcelTask.success_count, ExcelTask.fail_count)
+    ))
+    assert counts[task_id] == (2, 1)
+    # Other tasks are left alone
+    assert counts[other_id] == (0, 0)
+
+
+def test_fill_pending_pages_items_and_merges_history(session_factory, monkeypatch):
+    monkeypatch.setattr(excel_batch, "PENDING_PAGE_SIZE", 2)
+    task_id = _add_task(session_factory, ["成功", "待处理", "待处理", "待处理"])
+    shared_url = f"https://115.com/s/{task_id}-2"
+
+    async def scenario():
+        async with session_factory() as session:
+            session.add(LinkHistory(original_url=shared_url, share_link="https://115.com/s/new"))
+            await session.commit()
+
+        service = excel_batch.ExcelBatchService()
+        await service._fill_pending(task_id)
+        first_page = list(service._pending)
+        first_history = dict(service._history)
+
+        # Claim the page like the worker does, then load the next one while row 3 is in flight
+        async with session_factory() as session:
+            await session.execute(
+                ExcelTaskItem.__table__.update()
+                .where(ExcelTaskItem.row_index.in_([2, 3]), ExcelTaskItem.task_id == task_id)
+                .values(status="处理中")
+            )
+            await session.commit()
+        await service._fill_pending(task_id)
+        return first_page, first_history, list(service._pending), dict(service._history)
+
+    first_page, first_history, second_page, second_history = asyncio.run(scenario())
+
+    assert [row_index for _, row_index in first_page] == [2, 3]
+    assert first_history == {shared_url: "https://115.com/s/new", f"https://115.com/s/{task_id}-3": None}
+    assert [row_index for _, row_index in second_page] == [4]
+    # The in-flight item's prefetched entry survives loading the next page
+    assert second_history == {**first_history, f"https://115.com/s/{task_id}-4": None}
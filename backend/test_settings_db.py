@@ -0,0 +1,209 @@
+import asyncio
+import sqlite3
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+import app.core.config as config_module
+from app.core.config import Settings, _schema_hash
+
+# Schema as created by the baseline models, before dedup_count and the composite item index
+BASELINE_DDL = """
+CREATE TABLE users (
+    id INTEGER NOT NULL,
+    username VARCHAR(50) NOT NULL,
+    hashed_password VARCHAR(255) NOT NULL,
+    avatar_url TEXT NOT NULL,
+    created_at DATETIME NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_users_username ON users (username);
+CREATE TABLE system_settings (
+    "key" VARCHAR(50) NOT NULL,
+    value TEXT NOT NULL,
+    description VARCHAR(255),
+    PRIMARY KEY ("key")
+);
+CREATE TABLE pending_links (
+    id INTEGER NOT NULL,
+    share_url VARCHAR(255) NOT NULL,
+    metadata_json JSON NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_check DATETIME NOT NULL,
+    created_at DATETIME NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE TABLE link_history (
+    id INTEGER NOT NULL,
+    original_url VARCHAR(255) NOT NULL,
+    share_link TEXT NOT NULL,
+    created_at DATETIME NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_link_history_original_url ON link_history (original_url);
+CREATE TABLE excel_tasks (
+    id INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    total_count INTEGER NOT NULL,
+    success_count INTEGER NOT NULL,
+    fail_count INTEGER NOT NULL,
+    target_dir VARCHAR(255),
+    interval_min INTEGER NOT NULL,
+    interval_max INTEGER NOT NULL,
+    skip_count INTEGER NOT NULL,
+    current_row INTEGER NOT NULL,
+    is_waiting BOOLEAN NOT NULL,
+    target_channels JSON,
+    white_list_keywords TEXT,
+    black_list_keywords TEXT,
+    created_at DATETIME NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE TABLE excel_task_items (
+    id INTEGER NOT NULL,
+    task_id INTEGER NOT NULL,
+    row_index INTEGER NOT NULL,
+    original_url VARCHAR(255) NOT NULL,
+    title VARCHAR(255),
+    extraction_code VARCHAR(50),
+    status VARCHAR(20) NOT NULL,
+    new_share_url TEXT,
+    error_msg TEXT,
+    item_metadata JSON,
+    created_at DATETIME NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE INDEX ix_excel_task_items_task_id ON excel_task_items (task_id);
+INSERT INTO excel_tasks (id, name, status, total_count, success_count, fail_count, interval_min,
+    interval_max, skip_count, current_row, is_waiting, created_at)
+    VALUES (1, 'old.xlsx', 'completed', 3, 2, 1, 5, 10, 0, 0, 0, '2024-01-01 00:00:00');
+INSERT INTO system_settings ("key", value) VALUES ('WEB_PORT', '9000'), ('PROXY_ENABLED', 'True');
+"""
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the settings module at a throwaway SQLite file"""
+    path = tmp_path / "p115share.db"
+    # NullPool: every test runs its own event loop, pooled aiosqlite connections can't cross loops
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    monkeypatch.setattr(config_module, "engine", engine)
+    monkeypatch.setattr(config_module, "async_session", async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+    return path
+
+
+def _query(path, sql):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(sql).fetchall()
+
+
+def _indexes(path, table):
+    return {row[1] for row in _query(path, f"PRAGMA index_list({table})")}
+
+
+def test_init_db_fresh(db_path):
+    settings = Settings()
+    asyncio.run(settings.init_db())
+
+    stored = dict(_query(db_path, 'SELECT "key", value FROM system_settings'))
+    assert set(stored) == set(Settings.model_fields)
+    assert stored["WEB_PORT"] == str(settings.WEB_PORT)
+    assert _query(db_path, "SELECT username FROM users") == [("admin",)]
+    assert "ix_items_task_status_row" in _indexes(db_path, "excel_task_items")
+    assert _query(db_path, "PRAGMA user_version")[0][0] == _schema_hash()
+
+    # A second start finds everything in place and changes nothing
+    asyncio.run(Settings().init_db())
+    assert _query(db_path, "SELECT count(*) FROM users")[0][0] == 1
+    assert len(_query(db_path, "SELECT * FROM system_settings")) == len(Settings.model_fields)
+
+
+def test_init_db_migrates_baseline_database(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(BASELINE_DDL)
+
+    settings = Settings()
+    asyncio.run(settings.init_db())
+
+    columns = {row[1] for row in _query(db_path, "PRAGMA table_info(excel_tasks)")}
+    assert "dedup_count" in columns
+    assert _query(db_path, "SELECT total_count, success_count, dedup_count FROM excel_tasks") == [(3, 2, 0)]
+
+    item_indexes = _indexes(db_path, "excel_task_items")
+    assert "ix_items_task_status_row" in item_indexes
+    assert "ix_excel_task_items_task_id" not in item_indexes
+    assert "ix_pending_links_status" in _indexes(db_path, "pending_links")
+    assert _query(db_path, "PRAGMA user_version")[0][0] == _schema_hash()
+
+    # Stored values win over defaults and are cast back to the declared types
+    assert settings.WEB_PORT == 9000
+    assert settings.PROXY_ENABLED is True
+    assert settings.get("WEB_PORT") == 9000
+    stored = dict(_query(db_path, 'SELECT "key", value FROM system_settings'))
+    assert set(stored) == set(Settings.model_fields)
+    assert stored["WEB_PORT"] == "9000"
+
+
+def test_deferred_writes_are_coalesced(db_path, monkeypatch):
+    monkeypatch.setattr(config_module, "FLUSH_DELAY", 0.05)
+    settings = Settings()
+    persisted = []
+    persist = settings._persist_settings
+
+    async def recording_persist(changes):
+        persisted.append(dict(changes))
+        await persist(changes)
+
+    monkeypatch.setattr(settings, "_persist_settings", recording_persist)
+
+    async def scenario():
+        await settings.init_db()
+        settings.start_writer()
+        await settings.save_setting("LOG_LEVEL", "DEBUG")
+        await settings.save_settings_bulk({"LOG_LEVEL": "WARNING", "P115_SAVE_DIR": "/batch"})
+        await settings.save_setting("WEB_PORT", 8080)
+        # Nothing written yet: the saves only updated memory
+        assert persisted == []
+        assert settings.LOG_LEVEL == "WARNING"
+        await settings.stop_writer()
+
+    asyncio.run(scenario())
+
+    assert persisted == [{"LOG_LEVEL": "WARNING", "P115_SAVE_DIR": "/batch", "WEB_PORT": 8080}]
+    stored = dict(_query(db_path, 'SELECT "key", value FROM system_settings'))
+    assert (stored["LOG_LEVEL"], stored["P115_SAVE_DIR"], stored["WEB_PORT"]) == ("WARNING", "/batch", "8080")
+
+
+def test_failed_flush_keeps_keys_dirty_for_retry(db_path, monkeypatch):
+    monkeypatch.setattr(config_module, "FLUSH_DELAY", 0.01)
+    settings = Settings()
+    persist = settings._persist_settings
+    attempts = []
+
+    async def flaky_persist(changes):
+        attempts.append(set(changes))
+        if len(attempts) == 1:
+            raise RuntimeError("database is locked")
+        await persist(changes)
+
+    monkeypatch.setattr(settings, "_persist_settings", flaky_persist)
+
+    async def scenario():
+        await settings.init_db()
+        settings.start_writer()
+        await settings.save_setting("TMDB_API_KEY", "abc")
+        await settings._flush_task
+        # The failed write left the key dirty instead of dropping it
+        assert settings._dirty_keys == {"TMDB_API_KEY"}
+        await settings.save_setting("P115_SAVE_DIR", "/retry")
+        await settings.stop_writer()
+        assert settings._dirty_keys == set()
+
+    asyncio.run(scenario())
+
+    assert attempts == [{"TMDB_API_KEY"}, {"TMDB_API_KEY", "P115_SAVE_DIR"}]
+    stored = dict(_query(db_path, 'SELECT "key", value FROM system_settings'))
+    assert (stored["TMDB_API_KEY"], stored["P115_SAVE_DIR"]) == ("abc", "/retry")
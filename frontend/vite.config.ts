@@ -25,6 +25,10 @@ export default defineConfig({
         target: 'http://localhost:8000',
         changeOrigin: true,
       },
+      '/avatars': {
+        target: 'http://localhost:8000',
+        changeOrigin: true,
+      },
     },
   },
 })